@@ -1,11 +1,15 @@
 from decimal import Decimal
-from typing import Optional
+from typing import Dict, Optional
 import datetime
-from fastapi import FastAPI, Header, HTTPException
+import hashlib
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 import os
 
+import orjson
+from requests.adapters import HTTPAdapter
 from tempoapiclient import client
-from models import Consultant, BillMode
+from models import Consultant, BillMode, Invoice, WORK_LOGS_CACHE_TTL
 
 TEMPO_TOKEN = os.environ["TEMPO_TOKEN"]
 TEMPO_BASE_URL = os.environ["TEMPO_BASE_URL"]
@@ -17,15 +21,50 @@ CONSULTANT_BILLING_MODE = BillMode.MONTHLY if os.environ["CONSULTANT_BILLING_MOD
 # Don't judge me, I just want to get this working on local with minimum effort
 TOKEN = os.environ["DONT_JUDGE_ITS_LOCAL_TOKEN"]
 
-app = FastAPI()
+# Connections kept alive to Tempo, enough for every worker thread of the default executor (at most 32)
+TEMPO_POOL_SIZE = 32
+
+app = FastAPI(default_response_class=ORJSONResponse)
 tempo = client.Tempo(auth_token=TEMPO_TOKEN, base_url=TEMPO_BASE_URL)
+# Tempo client reuses a single `requests.Session`, size its pool so concurrent requests don't open new connections
+tempo._session.mount(TEMPO_BASE_URL, HTTPAdapter(pool_connections=1, pool_maxsize=TEMPO_POOL_SIZE))
+
+
+@app.on_event("shutdown")
+def close_tempo():
+    tempo.close()
+
+
+def invoices_json(payouts: Dict[datetime.date, Invoice]) -> bytes:
+    """Encodes invoices keyed by invoice date one at a time, so no dict of all invoices is built"""
+    return b"{%b}" % b",".join(
+        # orjson encodes dates natively as ISO 8601 strings
+        b"%b:%b" % (orjson.dumps(invoice_date), orjson.dumps(invoice.to_json()))
+        for invoice_date, invoice in payouts.items()
+    )
 
 
 @app.get("/invoices/")
-def get_invoices(start_date: datetime.date, end_date: Optional[datetime.date] = None, token: Optional[str] = Header(None)):
+async def get_invoices(
+    start_date: datetime.date,
+    end_date: Optional[datetime.date] = None,
+    token: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
     if token != TOKEN:
         raise HTTPException(status_code=401, detail="UnAuthorized!")
     c = Consultant(billing_mode=CONSULTANT_BILLING_MODE, rate=CONSULTANT_RATE, tempo_instance=tempo)
-    payouts = c.invoices_in_range(start_date=start_date, end_date=end_date)
+    payouts = await c.invoices_in_range_async(start_date=start_date, end_date=end_date)
+
+    body = invoices_json(payouts)
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    # Invoices of weeks which are over do not change anymore
+    if payouts and max(payouts) < datetime.date.today():
+        cache_control = "private, max-age=31536000, immutable"
+    else:
+        cache_control = f"private, max-age={WORK_LOGS_CACHE_TTL}"
+
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
 
-    return {p.invoice_date.isoformat(): p.to_json() for p in payouts.values()}
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": cache_control})
@@ -1,10 +1,13 @@
+import asyncio
 import calendar
 import os
-from dataclasses import dataclass, field, asdict
+import time
+from dataclasses import dataclass, field
 import datetime
 from decimal import Decimal
 from enum import Enum
-from typing import List, Dict, Optional
+from functools import cached_property, lru_cache
+from typing import List, Dict, Optional, Tuple
 
 from tempoapiclient.client import Tempo
 
@@ -12,42 +15,29 @@ from tempoapiclient.client import Tempo
 JIRA_BASE_URL = os.environ["JIRA_BASE_URL"]
 TEMPO_BASE_URL = os.environ["TEMPO_BASE_URL"]
 
+# Work logs of a range which has not ended yet are refetched from Tempo after this many seconds
+WORK_LOGS_CACHE_TTL = 60 * 60
 
-def to_json(object):
-    def format_value(value):
-        json_val = value
-        if isinstance(json_val, (datetime.date, datetime.datetime)):
-            json_val = json_val.isoformat()
-        elif isinstance(json_val, Decimal):
-            json_val = str(json_val)
-        elif isinstance(json_val, BillMode):
-            json_val = {"name": json_val.name, "value": json_val.value}
-        elif isinstance(json_val, list):
-            json_val = [format_value(curr_val) for curr_val in json_val]
-        elif isinstance(json_val, dict):
-            json_val = {format_value(curr_key): format_value(curr_val) for curr_key, curr_val in json_val.items()}
-        elif isinstance(json_val, (WorkLog, InvoiceItem, Invoice)):
-            json_val = json_val.to_json()
-        elif isinstance(json_val, (TempoUser, JiraIssue)):
-            json_val = asdict(json_val)
-        return json_val
+_SECONDS_PER_HOUR = Decimal(60 * 60)
+# A day with more than these many billable seconds (3 hours) is a workday even on weekends
+_MIN_WORKDAY_SECONDS = 3 * 60 * 60
+# Work unit of a day in monthly billing
+_DAY_WORK_UNIT = Decimal(1)
 
-    json_dict = {}
-
-    for key, val in object.__dict__.items():
-        json_val = format_value(val)
-        json_key = format_value(key)
-        json_dict[json_key] = json_val
-
-    return json_dict
+# Offsets from a date to the Saturday starting and the Friday ending its billing week, indexed by weekday (Monday is 0)
+_BILLING_START_OFFSETS = tuple(datetime.timedelta(days=days) for days in (-2, -3, -4, -5, -6, 0, -1))
+_BILLING_END_OFFSETS = tuple(datetime.timedelta(days=days) for days in (4, 3, 2, 1, 0, 6, 5))
 
 
 class BillMode(Enum):
     MONTHLY = "M"
     HOURLY = "H"
 
+    def to_json(self) -> Dict:
+        return {"name": self.name, "value": self.value}
+
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TempoUser:
     account_id: str
     name: str
@@ -55,12 +45,15 @@ class TempoUser:
     def __str__(self):
         return f"{JIRA_BASE_URL}/user?accountId={self.account_id}"
 
+    def to_json(self) -> Dict:
+        return {"account_id": self.account_id, "name": self.name}
+
     @classmethod
     def from_tempo_api(cls, api_dict: Dict):
         return cls(account_id=api_dict["accountId"], name=api_dict["displayName"])
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class JiraIssue:
     key: str
     jira_id: int
@@ -68,12 +61,15 @@ class JiraIssue:
     def __str__(self):
         return f"{JIRA_BASE_URL}/issue/{self.key}"
 
+    def to_json(self) -> Dict:
+        return {"key": self.key, "jira_id": self.jira_id}
+
     @classmethod
     def from_tempo_api(cls, api_dict: Dict):
         return cls(key=api_dict["key"], jira_id=api_dict["id"])
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WorkLog:
     """WorkLog
 
@@ -95,53 +91,26 @@ class WorkLog:
     def __str__(self):
         return f"{TEMPO_BASE_URL}/worklogs/{self.worklog_id}"
 
-    def __add__(self, other):
-        return self.__add(other)
-
-    def __radd__(self, other):
-        return self.__add(other)
-
-    def __add(self, other) -> Decimal:
-        """Add
-
-        Used in __add__ and __radd__
-
-        Each WorkLog can be added to any int, float, decimal or another WorkLog.
-        `hours` attribute is added.
-
-        Args:
-            other (any): Object with which hours needs to be added
-
-        Returns:
-            Decimal: Sum of self.hours and other
-        """
-        if isinstance(other, WorkLog):
-            other = other.hours
-        elif isinstance(other, (int, float)):
-            other = str(other)
-
-        return self.hours + Decimal(other)
-
     @property
     def hours(self):
         """Hours"""
-        return self.billable_seconds / Decimal(60 * 60)
-
-    def to_json(self):
-        json_dict = {"hours": str(self.hours)}
-        json_dict.update(to_json(self))
-        return json_dict
-
-    @staticmethod
-    def filter_account_value(attribute) -> bool:
-        """Filter Account Value
-
-        Filter function for filtering attribute.
+        return self.billable_seconds / _SECONDS_PER_HOUR
 
-        Returns:
-            bool: True if attribute is for Account, False otherwise
-        """
-        return attribute["key"] == "_Account_"
+    def to_json(self) -> Dict:
+        return {
+            "hours": str(self.hours),
+            "worklog_id": self.worklog_id,
+            "jira_id": self.jira_id,
+            "time_spent_seconds": self.time_spent_seconds,
+            "billable_seconds": self.billable_seconds,
+            "date": self.date.isoformat(),
+            "description": self.description,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "author": self.author.to_json(),
+            "issue": self.issue.to_json(),
+            "account": self.account,
+        }
 
     @classmethod
     def from_tempo_api(cls, worklog_dict: Dict):
@@ -152,18 +121,45 @@ class WorkLog:
             billable_seconds=worklog_dict["billableSeconds"],
             date=datetime.date.fromisoformat(worklog_dict["startDate"]),
             description=worklog_dict["description"],
-            created_at=datetime.datetime.strptime(worklog_dict["createdAt"], "%Y-%m-%dT%H:%M:%SZ").replace(
-                tzinfo=datetime.timezone.utc
-            ),
-            updated_at=datetime.datetime.strptime(worklog_dict["updatedAt"], "%Y-%m-%dT%H:%M:%SZ").replace(
-                tzinfo=datetime.timezone.utc
-            ),
+            created_at=datetime.datetime.fromisoformat(worklog_dict["createdAt"].replace("Z", "+00:00")),
+            updated_at=datetime.datetime.fromisoformat(worklog_dict["updatedAt"].replace("Z", "+00:00")),
             author=TempoUser.from_tempo_api(worklog_dict["author"]),
             issue=JiraIssue.from_tempo_api(worklog_dict["issue"]),
-            account=list(filter(WorkLog.filter_account_value, worklog_dict["attributes"]["values"]))[0],
+            # First attribute for Account, if any
+            account=next(
+                (attribute for attribute in worklog_dict["attributes"]["values"] if attribute["key"] == "_Account_"),
+                None,
+            ),
         )
 
 
+@lru_cache(maxsize=512)
+def _cached_work_logs(
+    tempo_instance: Tempo, start_date: datetime.date, end_date: datetime.date, ttl_bucket: Optional[int]
+) -> Tuple[WorkLog, ...]:
+    return tuple(map(WorkLog.from_tempo_api, tempo_instance.get_worklogs(dateFrom=start_date, dateTo=end_date)))
+
+
+def get_work_logs(tempo_instance: Tempo, start_date: datetime.date, end_date: datetime.date) -> Tuple[WorkLog, ...]:
+    """Get Work Logs
+
+    Fetches work logs between start date and end date, both inclusive, from Tempo.
+    Parsed work logs are cached: ranges ending before today are considered closed and kept until evicted,
+    ranges including today are refetched once every `WORK_LOGS_CACHE_TTL` seconds.
+    WorkLog objects are frozen, so cached ones can be shared between invoices.
+
+    Args:
+        tempo_instance (Tempo): Tempo client
+        start_date (datetime.date): Start date of range
+        end_date (datetime.date): End date of range
+
+    Returns:
+        tuple: WorkLog objects
+    """
+    ttl_bucket = None if end_date < datetime.date.today() else int(time.time() // WORK_LOGS_CACHE_TTL)
+    return _cached_work_logs(tempo_instance, start_date, end_date, ttl_bucket)
+
+
 @dataclass
 class InvoiceItem:
     """InvoiceItem
@@ -178,38 +174,22 @@ class InvoiceItem:
     def __str__(self):
         return f"{self.date.isoformat()} - {self.work_unit}"
 
-    def __add__(self, other):
-        return self.__add(other)
-
-    def __radd__(self, other):
-        return self.__add(other)
+    @cached_property
+    def total_billable_seconds(self) -> int:
+        """Total Billable Seconds
 
-    def __add(self, other):
-        """Add
-
-        Used in __add__ and __radd__
-
-        Each InvoiceItem can be added to any int, float, decimal or another InvoiceItem.
-        `work_unit` attribute is added.
-
-        Args:
-            other (any): Object with which work_unit needs to be added
+        Computed once, so all work logs must be added before it is accessed.
 
         Returns:
-            Decimal: Sum of self.work_unit and other
+            int: Sum of billable seconds of each work log
         """
-        if isinstance(other, InvoiceItem):
-            other = other.work_unit
-        elif isinstance(other, (int, float)):
-            other = str(other)
-
-        return self.work_unit + Decimal(other)
+        return sum(work_log.billable_seconds for work_log in self.work_logs)
 
-    @property
+    @cached_property
     def total_work_hours(self) -> Decimal:
-        return sum(self.work_logs)
+        return self.total_billable_seconds / _SECONDS_PER_HOUR
 
-    @property
+    @cached_property
     def is_workday(self) -> bool:
         """Is Workday
 
@@ -218,9 +198,9 @@ class InvoiceItem:
         Returns:
             True if total work hours is more than 0 or weekday is in Mon-Fri
         """
-        return self.total_work_hours > 3 or self.date.weekday() < 5
+        return self.total_billable_seconds > _MIN_WORKDAY_SECONDS or self.date.weekday() < 5
 
-    @property
+    @cached_property
     def work_unit(self) -> Decimal:
         """Work Unit
 
@@ -230,17 +210,18 @@ class InvoiceItem:
         return (
             self.total_work_hours
             if self.billing_mode == BillMode.HOURLY
-            else Decimal(True)
+            else _DAY_WORK_UNIT
         )
 
-    def to_json(self):
-        json_dict = {
+    def to_json(self) -> Dict:
+        return {
             "total_work_hours": str(self.total_work_hours),
             "is_workday": self.is_workday,
             "work_unit": str(self.work_unit),
+            "date": self.date.isoformat(),
+            "billing_mode": self.billing_mode.to_json(),
+            "work_logs": [work_log.to_json() for work_log in self.work_logs],
         }
-        json_dict.update(to_json(self))
-        return json_dict
 
 
 @dataclass
@@ -248,6 +229,7 @@ class Invoice:
     """Invoice
 
     Represents a Invoice object for work done between start date and invoice date, both inclusive.
+    Invoice items are only created for dates which have work logs, see `item_for_date`.
     """
 
     start_date: datetime.date
@@ -256,30 +238,53 @@ class Invoice:
 
     rate: Decimal
     billing_mode: BillMode
+    # Keyed by date: `datetime.date` caches its hash, so lookups cost the same as with ordinal int keys
     items: Dict[datetime.date, InvoiceItem] = field(default_factory=dict)
 
-    def __post_init__(self):
-        """
-        Initialize self.items with all dates in the invoice and a blank bill
-        """
-        next_date = self.start_date
-        while next_date <= self.invoice_date:
-            self.items[next_date] = InvoiceItem(date=next_date, billing_mode=self.billing_mode)
-            next_date += datetime.timedelta(days=1)
-
     def __str__(self):
         return f"{self.invoice_date.isoformat()} - {self.invoice_amount}"
 
-    @property
+    @cached_property
+    def dates(self) -> Tuple[datetime.date, ...]:
+        """Dates
+
+        Returns:
+            tuple: All dates in the invoice
+        """
+        return tuple(
+            map(datetime.date.fromordinal, range(self.start_date.toordinal(), self.invoice_date.toordinal() + 1))
+        )
+
+    def item_for_date(self, date: datetime.date) -> InvoiceItem:
+        """Item for Date
+
+        Args:
+            date (datetime.date): Any date of the invoice
+
+        Returns:
+            InvoiceItem: Invoice item of the date, created and added to self.items on first use
+        """
+        item = self.items.get(date)
+        if item is None:
+            item = self.items[date] = InvoiceItem(date=date, billing_mode=self.billing_mode)
+        return item
+
+    @cached_property
     def total_work_unit(self) -> Decimal:
         """Total Work Unit
 
+        Summed as int, billable seconds in case of hourly and days in case of monthly billing,
+        and converted to Decimal only once.
+
         Returns:
             Decimal: Sum of work unit of each items
         """
-        return sum(self.items.values())
+        if self.billing_mode == BillMode.HOURLY:
+            return sum(item.total_billable_seconds for item in self.items.values()) / _SECONDS_PER_HOUR
+        # Every day of the invoice is one work unit
+        return Decimal(len(self.dates))
 
-    @property
+    @cached_property
     def net_rate(self) -> Decimal:
         """Net Rate
 
@@ -293,6 +298,10 @@ class Invoice:
         """
         if self.billing_mode == BillMode.HOURLY:
             rate: Decimal = self.rate
+        elif (self.start_date.year, self.start_date.month) == (self.invoice_date.year, self.invoice_date.month):
+            # Whole invoice falls in one month, so daily rate of that month is the net rate
+            _, no_of_days_in_month = calendar.monthrange(self.start_date.year, self.start_date.month)
+            rate: Decimal = self.rate / no_of_days_in_month
         else:
             # For monthly, we calculate on the basis of number of days in a month
             start_day_of_month, no_of_days_in_start_month = calendar.monthrange(self.start_date.year, self.start_date.month)
@@ -309,7 +318,7 @@ class Invoice:
                 rate = ((rate_in_start_month * work_days_in_start_month) + (rate_in_end_month * work_days_in_end_month)) / (work_days_in_start_month + work_days_in_end_month)
         return round(rate, 4)
 
-    @property
+    @cached_property
     def invoice_amount(self) -> Decimal:
         """Invoice Amount"""
         return round(self.net_rate * self.total_work_unit, 4)
@@ -325,26 +334,35 @@ class Invoice:
         """
         return self.invoice_date + datetime.timedelta(days=30)
 
+    @cached_property
     def total_work_days(self) -> int:
         """Total Work Days
 
+        Days without invoice item have no work logs, so they are work days only if they are in Mon-Fri.
+
         Returns:
             int: Sum of work days in each bill
         """
-        return sum(int(bill.is_workday) for bill in self.items.values())
+        return sum(
+            int(self.items[date].is_workday if date in self.items else date.weekday() < 5) for date in self.dates
+        )
 
     def to_json(self) -> Dict:
-        json_dict = {
-            "total_work_days": str(self.total_work_days()),
+        # Days without work logs are serialized as blank invoice items
+        items = (self.items.get(date) or InvoiceItem(date=date, billing_mode=self.billing_mode) for date in self.dates)
+        return {
+            "total_work_days": str(self.total_work_days),
             "total_work_unit": str(self.total_work_unit),
             "net_rate": str(self.net_rate),
             "invoice_amount": str(self.invoice_amount),
             "due_date": self.due_date.isoformat(),
+            "start_date": self.start_date.isoformat(),
+            "invoice_date": self.invoice_date.isoformat(),
+            "rate": str(self.rate),
+            "billing_mode": self.billing_mode.to_json(),
+            "items": {item.date.isoformat(): item.to_json() for item in items},
         }
 
-        json_dict.update(to_json(self))
-        return json_dict
-
 
 @dataclass
 class Consultant:
@@ -369,24 +387,12 @@ class Consultant:
             tuple: tuple of start_date, end_date
         """
         weekday = date.weekday()
-
-        if weekday >= 5:
-            # If it's Saturday or Sunday, timedelta for start_date is date's weekday - 5 (i.e. Saturday's weekday)
-            start_date = date - datetime.timedelta(days=weekday - 5)
-            # Timedelta for end_date is 6 - date's weekday (no. of days to Sunday) + Friday's weekday (4) + 1
-            end_date = date + datetime.timedelta(days=5 + (6 - weekday))
-        else:
-            # Otherwise, time delta is date's weekday + 2 (reversing weekday takes on Monday, and 2 days for Sun & Sat)
-            start_date = date - datetime.timedelta(days=weekday + 2)
-            # Timedelta for end_date is Friday's Weekday (4) - date's weekday
-            end_date = date + datetime.timedelta(days=4 - weekday)
-
-        return start_date, end_date
+        return date + _BILLING_START_OFFSETS[weekday], date + _BILLING_END_OFFSETS[weekday]
 
     def __invoice_for_work_date(self, work_date: datetime.date) -> Invoice:
         """Invoice for work date
 
-        Computes Invoice for a given work date.
+        Computes blank Invoice for a given work date. Work logs are added by `invoices_in_range`.
 
         Args:
             work_date (datetime.date): Can we any date within 7 days week period
@@ -395,20 +401,28 @@ class Consultant:
             Invoice: Invoice object
         """
         start_date, end_date = Consultant.billing_date_bounds(date=work_date)
-        invoice = Invoice(start_date=start_date, invoice_date=end_date, billing_mode=self.billing_mode, rate=self.rate)
+        return Invoice(start_date=start_date, invoice_date=end_date, billing_mode=self.billing_mode, rate=self.rate)
+
+    @staticmethod
+    def work_dates_in_range(start_date: datetime.date, end_date: datetime.date) -> List[datetime.date]:
+        """Work Dates in Range
 
-        work_logs = self.tempo_instance.get_worklogs(dateFrom=start_date, dateTo=end_date)
-        work_log_objects = map(WorkLog.from_tempo_api, work_logs)
+        Picks one work date for each billing week between start date and end date
 
-        # Add all work log in invoice items
-        [invoice.items[work_log.date].work_logs.append(work_log) for work_log in work_log_objects]
+        Args:
+            start_date (datetime.date): Start date of range
+            end_date (datetime.date): End date of range
 
-        return invoice
+        Returns:
+            list: Work dates, 7 days apart, starting from start date
+        """
+        return [start_date + datetime.timedelta(days=days) for days in range(0, (end_date - start_date).days + 1, 7)]
 
     def invoices_in_range(self, start_date: datetime.date, end_date: Optional[datetime.date]) -> Dict[datetime.date, Invoice]:
         """Invoices in Range
 
-        Computes all possible invoices for work done between start date and end date
+        Computes all possible invoices for work done between start date and end date.
+        Work logs of the whole range are fetched from Tempo at once and then added to the invoice item of their date.
 
         Args:
             start_date (datetime.date): Start date of range
@@ -418,11 +432,35 @@ class Consultant:
             dict: Dictionary containing invoice date as key and corresponding Invoice object as value
         """
         end_date = end_date or datetime.date.today()
-        invoices = {}
-        next_date = start_date
-        while next_date <= end_date:
-            invoice = self.__invoice_for_work_date(work_date=next_date)
-            next_date += datetime.timedelta(days=7)
-            invoices[invoice.invoice_date] = invoice
-
-        return invoices
+        invoices = [
+            self.__invoice_for_work_date(work_date=work_date)
+            for work_date in Consultant.work_dates_in_range(start_date, end_date)
+        ]
+        if not invoices:
+            return {}
+
+        # Billing weeks are consecutive, so first start date and last invoice date cover every invoice
+        first_date = invoices[0].start_date
+        work_logs = get_work_logs(self.tempo_instance, first_date, invoices[-1].invoice_date)
+
+        # Add all work log in invoice items, invoice of a work log is given by weeks since first start date
+        for work_log in work_logs:
+            invoices[(work_log.date - first_date).days // 7].item_for_date(work_log.date).work_logs.append(work_log)
+
+        return {invoice.invoice_date: invoice for invoice in invoices}
+
+    async def invoices_in_range_async(
+        self, start_date: datetime.date, end_date: Optional[datetime.date]
+    ) -> Dict[datetime.date, Invoice]:
+        """Invoices in Range (async)
+
+        Same as `invoices_in_range`, but runs the blocking Tempo call in a worker thread instead of the event loop.
+
+        Args:
+            start_date (datetime.date): Start date of range
+            end_date (:obj:`datetime.date`, optional): End date of range, defaults to today
+
+        Returns:
+            dict: Dictionary containing invoice date as key and corresponding Invoice object as value
+        """
+        return await asyncio.to_thread(self.invoices_in_range, start_date=start_date, end_date=end_date)